@@ -0,0 +1,280 @@
+"""Benchmark di estus: riempie un database temporaneo con un inventario sintetico della dimensione richiesta,
+visita ogni pagina del sito con il client di test di Flask e ne misura i tempi di risposta, il numero di query
+e il picco di memoria, confrontandoli con quelli salvati in benchmark.json.
+
+Esempi:
+    python benchmark.py --dispositivi 10000
+    python benchmark.py --dispositivi 1000 --salva
+    python benchmark.py --dispositivi 100000 --solo-dati --database /tmp/inventario.sqlite
+
+Restituisce 1 se qualche pagina è peggiorata rispetto ai valori salvati, e 2 se non ci sono valori salvati per
+il numero di dispositivi richiesto (a meno che non venga usato --salva)."""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from sqlalchemy import event
+
+tipi = ["PC", "PC", "PC", "Portatile", "Monitor", "Monitor", "Stampante", "Scanner", "Telefono", "Switch"]
+marche = {
+    "PC": ["HP", "Dell", "Lenovo", "Fujitsu"],
+    "Portatile": ["HP", "Dell", "Lenovo", "Asus"],
+    "Monitor": ["LG", "Samsung", "Philips", "Dell"],
+    "Stampante": ["HP", "Brother", "Kyocera", "Epson"],
+    "Scanner": ["Canon", "Epson", "Fujitsu"],
+    "Telefono": ["Cisco", "Snom", "Yealink"],
+    "Switch": ["Cisco", "HP", "Netgear"],
+}
+sistemi = {
+    "PC": ["Windows 10", "Windows 10", "Windows 11", "Windows 7", "Ubuntu 22.04"],
+    "Portatile": ["Windows 10", "Windows 11", "Ubuntu 22.04"],
+}
+comuni = ["Vignola", "Castelnuovo Rangone", "Castelvetro", "Guiglia", "Marano sul Panaro", "Montese",
+          "Savignano sul Panaro", "Spilamberto", "Zocca"]
+servizi = ["Anagrafe", "Ufficio Scuola", "Sindaco", "Ragioneria", "Polizia Municipale", "Ufficio Tecnico",
+           "Biblioteca", "Servizi Sociali", "Segreteria", "Tributi"]
+nomi = ["Mario", "Luigi", "Giulia", "Francesca", "Marco", "Anna", "Paolo", "Chiara", "Luca", "Sara", "Andrea",
+        "Elena", "Giorgio", "Laura", "Stefano", "Silvia"]
+cognomi = ["Rossi", "Bianchi", "Ferrari", "Russo", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco",
+           "Bruno", "Gallo", "Conti", "Costa", "Giordano", "Mancini"]
+fornitori = ["ACME Informatica", "Computer Gross", "Data Service", "Emilia Ufficio", "Sistemi Srl"]
+
+
+def genera_inventario(server, dispositivi, seme=0, blocco=5000):
+    """Riempie il database del server con un inventario sintetico di circa dispositivi dispositivi, sempre uguale
+    a parità di seme. Le altre tabelle crescono in proporzione: un impiegato ogni due dispositivi, una rete ogni
+    250 e un ordine ogni 50, con in media un accesso e mezzo per dispositivo."""
+    casuale = random.Random(seme)
+    db = server.db
+
+    def inserisci(modello, righe):
+        for inizio in range(0, len(righe), blocco):
+            db.session.execute(modello.__table__.insert(), righe[inizio:inizio + blocco])
+
+    numero_enti = min(len(comuni), max(2, dispositivi // 5000))
+    inserisci(server.Ente, [{"eid": eid, "nomeente": f"Comune di {comuni[eid - 1]}",
+                             "nomebreveente": comuni[eid - 1][:2].upper()}
+                            for eid in range(1, numero_enti + 1)])
+    righe_servizi = []
+    for eid in range(1, numero_enti + 1):
+        for nome in servizi:
+            righe_servizi.append({"sid": len(righe_servizi) + 1, "eid": eid, "nomeservizio": nome,
+                                  "locazione": f"Piano {casuale.randint(0, 3)}"})
+    inserisci(server.Servizio, righe_servizi)
+    numero_impiegati = max(1, dispositivi // 2)
+    inserisci(server.Impiegato, [{"iid": iid, "sid": casuale.randint(1, len(righe_servizi)),
+                                  "nomeimpiegato": f"{casuale.choice(nomi)} {casuale.choice(cognomi)}",
+                                  "username": f"utente{iid}", "passwd": "password"}
+                                 for iid in range(1, numero_impiegati + 1)])
+    # La rete 1 è la rete nulla creata da inizializza_database
+    numero_reti = max(2, dispositivi // 250)
+    righe_reti = [{"nid": nid, "nome": f"Rete {nid}", "network_ip": f"10.{nid // 256}.{nid % 256}.0", "subnet": 24,
+                   "primary_dns": "10.0.0.1", "secondary_dns": "10.0.0.2"} for nid in range(2, numero_reti + 2)]
+    for riga in righe_reti:
+        riga["inizio"], riga["fine"] = server.intervallo_rete(riga["network_ip"], riga["subnet"])
+    inserisci(server.Rete, righe_reti)
+    numero_ordini = max(1, dispositivi // 50)
+    oggi = datetime.date.today()
+    righe_ordini = []
+    for oid in range(1, numero_ordini + 1):
+        data = oggi - datetime.timedelta(days=casuale.randint(0, 3650))
+        righe_ordini.append({"oid": oid, "data": data, "numero_ordine": str(1000 + oid),
+                             "garanzia": data + datetime.timedelta(days=365 * casuale.choice([1, 2, 3, 5])),
+                             "fornitore": casuale.choice(fornitori)})
+    inserisci(server.Ordine, righe_ordini)
+    righe_dispositivi = []
+    righe_accessi = []
+    for did in range(1, dispositivi + 1):
+        tipo = casuale.choice(tipi)
+        nid = casuale.randint(2, numero_reti + 1)
+        righe_dispositivi.append({
+            "did": did,
+            "tipo": tipo,
+            "marca": casuale.choice(marche[tipo]),
+            "modello": f"{chr(65 + casuale.randint(0, 25))}{casuale.randint(100, 999)}",
+            "inv_ced": did,
+            "inv_ente": 100000 + did,
+            "seriale": f"SN{casuale.getrandbits(40):010X}",
+            "ip": f"10.{nid // 256}.{nid % 256}.{casuale.randint(2, 254)}",
+            "hostname": f"{comuni[casuale.randrange(numero_enti)][:2].upper()}{did:06d}",
+            "so": casuale.choice(sistemi.get(tipo, [""])),
+            "nid": nid,
+            "oid": casuale.randint(1, numero_ordini) if casuale.random() < 0.8 else None,
+        })
+        righe_dispositivi[-1]["famiglia_so"] = server.famiglia_so(righe_dispositivi[-1]["so"])
+        righe_dispositivi[-1]["ip_intero"] = server.ip_a_intero(righe_dispositivi[-1]["ip"])
+        for iid in casuale.sample(range(1, numero_impiegati + 1), min(numero_impiegati, casuale.randint(0, 3))):
+            righe_accessi.append({"iid": iid, "did": did})
+    inserisci(server.Dispositivo, righe_dispositivi)
+    inserisci(server.Accesso, righe_accessi)
+    db.session.commit()
+    if server.app.config["ESTUS_CONTATORI"]:
+        server.ricalcola_contatori()
+
+
+def percorsi_da_misurare(server):
+    """Indirizzi di tutte le pagine visitabili in GET, con gli argomenti riempiti con righe esistenti.
+    Le pagine di cancellazione e il logout vengono saltati."""
+    db = server.db
+    valori = {
+        "eid": db.session.query(db.func.min(server.Ente.eid)).scalar(),
+        "sid": db.session.query(db.func.min(server.Servizio.sid)).scalar(),
+        "iid": db.session.query(db.func.min(server.Impiegato.iid)).scalar(),
+        "did": db.session.query(db.func.min(server.Dispositivo.did)).scalar(),
+        "nid": db.session.query(db.func.max(server.Rete.nid)).scalar(),
+        "oid": db.session.query(db.func.min(server.Ordine.oid)).scalar(),
+        "codice": db.session.query(server.Dispositivo.seriale).order_by(server.Dispositivo.did).limit(1).scalar(),
+        "entita": "dispositivi",
+    }
+    percorsi = []
+    for regola in server.app.url_map.iter_rules():
+        if "GET" not in regola.methods or regola.endpoint == "static" or regola.endpoint == "page_logout" \
+                or regola.endpoint.endswith("_del"):
+            continue
+        if not all(valori.get(argomento) is not None for argomento in regola.arguments):
+            continue
+        with server.app.test_request_context():
+            percorsi.append(server.url_for(regola.endpoint, **{a: valori[a] for a in regola.arguments}))
+    percorsi.append("/search?q=Rossi")
+    return sorted(percorsi)
+
+
+def percentile(valori, p):
+    ordinati = sorted(valori)
+    return ordinati[min(len(ordinati) - 1, int(len(ordinati) * p))]
+
+
+def misura(server, percorsi, ripetizioni):
+    """Visita ogni percorso ripetizioni volte, più una di riscaldamento, e una volta con tracemalloc attivo.
+    Restituisce per ogni percorso il codice di stato, i percentili 50 e 95 del tempo in millisecondi,
+    il numero di query e il picco di memoria in KB."""
+    client = server.app.test_client()
+    risposta = client.post("/login", data={"username": "stagista", "password": "smecds"})
+    if risposta.status_code != 302:
+        raise RuntimeError("Impossibile fare il login con l'utente predefinito")
+    query = [0]
+
+    def conta(*args, **kwargs):
+        query[0] += 1
+    with server.app.app_context():
+        event.listen(server.db.engine, "before_cursor_execute", conta)
+    risultati = dict()
+    for percorso in percorsi:
+        client.get(percorso).get_data()
+        tempi = []
+        for _ in range(ripetizioni):
+            query[0] = 0
+            inizio = time.perf_counter()
+            risposta = client.get(percorso)
+            risposta.get_data()
+            tempi.append((time.perf_counter() - inizio) * 1000)
+        numero_query = query[0]
+        # La memoria viene misurata a parte, dato che tracemalloc rallenta molto l'esecuzione
+        tracemalloc.start()
+        client.get(percorso).get_data()
+        _, picco = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        risultati[percorso] = {
+            "stato": risposta.status_code,
+            "p50": round(percentile(tempi, 0.5), 2),
+            "p95": round(percentile(tempi, 0.95), 2),
+            "query": numero_query,
+            "memoria": picco // 1024,
+        }
+    return risultati
+
+
+def confronta(risultati, riferimento, tolleranza):
+    """Confronta i risultati con quelli di riferimento: una pagina è peggiorata se esegue più query,
+    se cambia codice di stato, o se la mediana dei tempi o la memoria superano di più di tolleranza volte quelle di
+    riferimento (con un margine fisso, per non segnalare le variazioni casuali dei valori piccoli).
+    Il p95 non viene confrontato: con poche ripetizioni dipende troppo da quando interviene il garbage collector.
+    Restituisce la lista dei peggioramenti."""
+    peggioramenti = []
+    for percorso, attuale in risultati.items():
+        precedente = riferimento.get(percorso)
+        if precedente is None:
+            continue
+        if attuale["stato"] != precedente["stato"]:
+            peggioramenti.append(f"{percorso}: stato {precedente['stato']} -> {attuale['stato']}")
+        if attuale["query"] > precedente["query"]:
+            peggioramenti.append(f"{percorso}: {precedente['query']} -> {attuale['query']} query")
+        if attuale["p50"] > precedente["p50"] * tolleranza + 5:
+            peggioramenti.append(f"{percorso}: p50 {precedente['p50']} -> {attuale['p50']} ms")
+        if attuale["memoria"] > precedente["memoria"] * tolleranza + 1024:
+            peggioramenti.append(f"{percorso}: memoria {precedente['memoria']} -> {attuale['memoria']} KB")
+    return peggioramenti
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dispositivi", type=int, default=1000, help="dimensione dell'inventario (predefinito: 1000)")
+    parser.add_argument("--ripetizioni", type=int, default=20, help="richieste misurate per pagina (predefinito: 20)")
+    parser.add_argument("--seme", type=int, default=0, help="seme per generare l'inventario (predefinito: 0)")
+    parser.add_argument("--database", help="file SQLite da creare, invece di uno temporaneo")
+    parser.add_argument("--riferimento", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              "benchmark.json"),
+                        help="file con i risultati di riferimento (predefinito: benchmark.json)")
+    parser.add_argument("--tolleranza", type=float, default=1.5,
+                        help="peggioramento di tempo e memoria tollerato rispetto al riferimento (predefinito: 1.5)")
+    parser.add_argument("--salva", action="store_true", help="salva i risultati come nuovo riferimento")
+    parser.add_argument("--solo-dati", action="store_true", help="genera soltanto il database, senza misurare")
+    argomenti = parser.parse_args()
+
+    cartella = tempfile.mkdtemp(prefix="estus-benchmark-")
+    database = os.path.abspath(argomenti.database or os.path.join(cartella, "inventario.sqlite"))
+    if os.path.exists(database):
+        parser.error(f"il database {database} esiste già")
+    os.environ["estus_database_url"] = f"sqlite:///{database}"
+    os.environ.setdefault("flask_secret_key", os.urandom(16).hex())
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import server
+
+    with server.app.app_context():
+        inizio = time.perf_counter()
+        server.inizializza_database()
+        genera_inventario(server, argomenti.dispositivi, argomenti.seme)
+        print(f"Inventario di {argomenti.dispositivi} dispositivi generato in {time.perf_counter() - inizio:.1f} s "
+              f"in {database}")
+        if argomenti.solo_dati:
+            return 0
+        percorsi = percorsi_da_misurare(server)
+    risultati = misura(server, percorsi, argomenti.ripetizioni)
+
+    print(f"{'Pagina':<40} {'Stato':>5} {'p50 ms':>9} {'p95 ms':>9} {'Query':>6} {'Mem. KB':>8}")
+    for percorso, valori in risultati.items():
+        print(f"{percorso:<40} {valori['stato']:>5} {valori['p50']:>9.2f} {valori['p95']:>9.2f} "
+              f"{valori['query']:>6} {valori['memoria']:>8}")
+
+    riferimenti = dict()
+    if os.path.exists(argomenti.riferimento):
+        with open(argomenti.riferimento) as file:
+            riferimenti = json.load(file)
+    scala = str(argomenti.dispositivi)
+    if argomenti.salva:
+        riferimenti[scala] = risultati
+        with open(argomenti.riferimento, "w") as file:
+            json.dump(riferimenti, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Risultati salvati come riferimento per {scala} dispositivi in {argomenti.riferimento}")
+        return 0
+    if scala not in riferimenti:
+        # Senza riferimento non viene controllato niente: non deve sembrare un controllo superato
+        print(f"Nessun riferimento per {scala} dispositivi in {argomenti.riferimento}: eseguire con --salva "
+              f"per crearlo")
+        return 2
+    peggioramenti = confronta(risultati, riferimenti[scala], argomenti.tolleranza)
+    for peggioramento in peggioramenti:
+        print(f"PEGGIORATO {peggioramento}")
+    if not peggioramenti:
+        print(f"Nessun peggioramento rispetto al riferimento per {scala} dispositivi")
+    return 1 if peggioramenti else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())